@@ -4,19 +4,29 @@ Markdown Document Browser
 プロジェクト内のMDファイルを一覧表示・閲覧するWebアプリケーション
 """
 
-from flask import Flask, render_template, jsonify, send_from_directory, request, Response, send_file
+from flask import Flask, jsonify, send_from_directory, request, send_file
 from flask_cors import CORS
 import os
 import json
 from pathlib import Path
 from datetime import datetime
-import markdown2
+import mistune
 import chardet
+import codecs
+import unicodedata
+import hashlib
+import fnmatch
 import re
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, BinaryIO
 import weasyprint
+from weasyprint.text.fonts import FontConfiguration
 import tempfile
+import time
+import threading
 from io import BytesIO
+from functools import lru_cache
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 app = Flask(__name__)
 CORS(app)
@@ -25,22 +35,276 @@ app.config['JSON_AS_ASCII'] = False  # 日本語を正しくJSONで返す
 # 設定ファイルのパス
 CONFIG_FILE = "md_browser_config.json"
 
+# 生成済みPDFのキャッシュディレクトリ
+PDF_CACHE_DIR = "pdf_cache"
+
+# PDFのスタイルを変更したら更新する（古いキャッシュを使わないため）
+STYLE_VERSION = "v1"
+
+# UTF-8デコーダー（ファイルごとのコーデック検索を省くため一度だけ取得）
+UTF8_DECODE = codecs.getdecoder('utf-8')
+
+# レンダリング結果をキャッシュするファイル数
+RENDER_CACHE_SIZE = 256
+
+# プレビュー用に読み込む先頭バイト数
+PREVIEW_READ_BYTES = 4096
+
+# エンコーディング自動検出に使う先頭バイト数
+CHARDET_SAMPLE_BYTES = 65536
+
+# BOMとエンコーディングの対応（先頭一致で判定）
+BOM_ENCODINGS = (
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+# ファイル一覧キャッシュの有効期間（秒）
+# ディレクトリの更新日時で追加・削除・リネームは検出できるが、
+# 既存ファイルの上書き編集は検出できないため一定時間で再走査する
+LISTING_CACHE_TTL = 10
+
+# アンカー生成用の正規表現（記号除去・区切り文字）
+ANCHOR_NONWORD_RE = re.compile(r'[^\w\s-]')
+ANCHOR_DASH_RE = re.compile(r'[-\s]+')
+
+# PDF用スタイルシート（起動時に一度だけパースして使い回す）
+PDF_STYLESHEET = """
+@page {
+    size: A4;
+    margin: 20mm;
+    @bottom-center {
+        content: counter(page) " / " counter(pages);
+        font-size: 10pt;
+        color: #666;
+    }
+}
+
+body {
+    font-family: 'Noto Sans CJK JP', 'Hiragino Sans', 'Yu Gothic', sans-serif;
+    line-height: 1.8;
+    color: #333;
+}
+
+h1 {
+    color: #2c3e50;
+    border-bottom: 2px solid #3498db;
+    padding-bottom: 10px;
+    margin: 30px 0 20px;
+    page-break-after: avoid;
+}
+
+h2 {
+    color: #34495e;
+    border-bottom: 1px solid #bdc3c7;
+    padding-bottom: 8px;
+    margin: 25px 0 15px;
+    page-break-after: avoid;
+}
+
+h3 {
+    color: #34495e;
+    margin: 20px 0 10px;
+    page-break-after: avoid;
+}
+
+p {
+    margin: 12px 0;
+    text-align: justify;
+}
+
+code {
+    background: #f5f5f5;
+    padding: 2px 6px;
+    border-radius: 3px;
+    font-family: 'Consolas', 'Monaco', monospace;
+    font-size: 0.9em;
+}
+
+pre {
+    background: #f8f8f8;
+    border: 1px solid #ddd;
+    padding: 15px;
+    border-radius: 5px;
+    overflow-x: auto;
+    page-break-inside: avoid;
+    margin: 15px 0;
+}
+
+pre code {
+    background: none;
+    padding: 0;
+}
+
+table {
+    border-collapse: collapse;
+    width: 100%;
+    margin: 20px 0;
+    page-break-inside: avoid;
+}
+
+th, td {
+    border: 1px solid #ddd;
+    padding: 10px 15px;
+    text-align: left;
+}
+
+th {
+    background: #f8f9fa;
+    font-weight: bold;
+}
+
+tr:nth-child(even) {
+    background: #f9f9f9;
+}
+
+ul, ol {
+    margin: 15px 0;
+    padding-left: 30px;
+}
+
+li {
+    margin: 5px 0;
+}
+
+blockquote {
+    border-left: 4px solid #3498db;
+    padding-left: 20px;
+    margin: 20px 0;
+    color: #666;
+    font-style: italic;
+}
+
+a {
+    color: #3498db;
+    text-decoration: none;
+}
+
+.header {
+    text-align: center;
+    margin-bottom: 40px;
+    padding-bottom: 20px;
+    border-bottom: 2px solid #3498db;
+}
+
+.header h1 {
+    border: none;
+    margin: 0;
+    padding: 0;
+    font-size: 2em;
+}
+
+.metadata {
+    margin-top: 10px;
+    font-size: 0.9em;
+    color: #666;
+}
+
+.footer {
+    margin-top: 50px;
+    padding-top: 20px;
+    border-top: 1px solid #ddd;
+    text-align: center;
+    font-size: 0.85em;
+    color: #666;
+}
+"""
+
+# PDF用HTMLテンプレート（{title}, {date}, {encoding}, {content} を埋め込む）
+PDF_TEMPLATE = """
+<!DOCTYPE html>
+<html lang="ja">
+<head>
+    <meta charset="UTF-8">
+</head>
+<body>
+    <div class="header">
+        <h1>{title}</h1>
+        <div class="metadata">
+            生成日: {date}<br>
+            エンコーディング: {encoding}
+        </div>
+    </div>
+
+    {content}
+
+    <div class="footer">
+        MD Document Browser でエクスポート
+    </div>
+</body>
+</html>
+"""
+
+# PDF生成の同時実行数
+PDF_WORKERS = 2
+
+# PDF生成用のフォント設定とCSS（スレッドごとに保持）
+# FontConfigurationはPangoのフォントマップを持ち、スレッド間で共有できないため
+PDF_RESOURCES = threading.local()
+
+
+def init_pdf_thread():
+    """このスレッド用のフォント設定とCSSを作成（PDF生成スレッドの初期化処理）"""
+    PDF_RESOURCES.font_config = FontConfiguration()
+    PDF_RESOURCES.css = weasyprint.CSS(string=PDF_STYLESHEET, font_config=PDF_RESOURCES.font_config)
+
+
+def get_pdf_resources():
+    """このスレッド用のフォント設定とCSSを取得（未作成なら作成）"""
+    if not hasattr(PDF_RESOURCES, 'font_config'):
+        init_pdf_thread()
+    return PDF_RESOURCES.font_config, PDF_RESOURCES.css
+
+
+def asterisk_only_emphasis(md: mistune.Markdown):
+    """強調を * のみに限定するmistuneプラグイン（__init__ や snake_case を強調として扱わない）"""
+    md.inline.register(
+        "emphasis", r"\*{1,3}(?=[^\s*])",
+        lambda inline, m, state: inline.parse_emphasis(m, state))
+    # _ の連続は強調の区切りとして解釈されないテキストとして追加
+    md.inline.register("underscore", r"_+", parse_underscore)
+
+
+def parse_underscore(inline, m, state) -> int:
+    """_ の連続をそのままテキストとして出力"""
+    state.append_token({"type": "text", "raw": m.group(0), "_emphasis": False})
+    return m.end()
+
+
 class MDFileBrowser:
     """MDファイルブラウザークラス"""
 
     def __init__(self):
-        self.config = self.load_config()
-        self.markdown_renderer = markdown2.Markdown(
-            extras=[
-                "fenced-code-blocks",
-                "tables",
-                "strike",
-                "task-list",
-                "code-friendly",
-                "header-ids",
-                "toc"
+        # ファイル一覧キャッシュ {(プロジェクトパス, 再帰): (作成時刻, {ディレクトリ: 更新日時}, 結果)}
+        self._listing_cache = {}
+        # レンダリング結果のキャッシュ {パス: (更新日時, サイズ, 結果)}（LRU、パスごとに1件）
+        self._render_cache = OrderedDict()
+        self._render_cache_lock = threading.Lock()
+        self.apply_config(self.load_config())
+        self.markdown_renderer = mistune.create_markdown(
+            escape=False,
+            plugins=[
+                "strikethrough",
+                "table",
+                "task_lists",
+                "footnotes",
+                asterisk_only_emphasis
             ]
         )
+        # 見出しへのアンカーID付与と目次の作成を変換と同じパスで行う
+        self.markdown_renderer.before_render_hooks.append(self._collect_headings)
+
+    def apply_config(self, config: dict):
+        """設定を反映（プロジェクトパスと重要ファイルのパターンを準備し、一覧キャッシュを破棄）"""
+        self.config = config
+        self._project_paths = {str(Path(project["path"])) for project in config.get("projects", [])}
+        important_patterns = config.get("file_patterns", {}).get("important", [])
+        self._priority_patterns = [
+            (re.compile(fnmatch.translate(pattern), re.IGNORECASE), 1)  # 最高優先度
+            for pattern in important_patterns
+        ]
+        self.clear_listing_cache()
 
     def load_config(self) -> dict:
         """設定ファイルを読み込む"""
@@ -82,54 +346,105 @@ class MDFileBrowser:
             return default_config
 
     def save_config(self, config: dict):
-        """設定を保存"""
-        with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-            json.dump(config, f, ensure_ascii=False, indent=2)
+        """設定を保存（変更がなければ書き込まない）"""
+        if config == getattr(self, 'config', None):
+            return
+
+        # 一時ファイルに書いてから置き換え（書き込み中の中断や同時保存で設定ファイルが壊れないように）
+        config_dir = os.path.dirname(os.path.abspath(CONFIG_FILE)) or '.'
+        fd, tmp_path = tempfile.mkstemp(dir=config_dir, suffix='.tmp')
+        try:
+            # mkstempは0600で作成するため、既存の設定ファイルと同じ権限にする
+            mode = os.stat(CONFIG_FILE).st_mode & 0o777 if os.path.exists(CONFIG_FILE) else 0o644
+            os.fchmod(fd, mode)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(config, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, CONFIG_FILE)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
 
     def get_project_md_files(self, project_path: str, recursive: bool = True) -> List[Dict]:
         """プロジェクト内のMDファイルを取得"""
-        md_files = []
         path = Path(project_path)
 
         if not path.exists():
             return []
 
+        # 走査したディレクトリがどれも更新されていなければキャッシュを返す
+        cache_key = (str(path), recursive)
+        cached = self._listing_cache.get(cache_key)
+        if cached and self._is_listing_fresh(cached[0], cached[1]):
+            return list(cached[2])
+
         # 除外ディレクトリのセット
         excluded = set(self.config.get("excluded_dirs", []))
 
-        if recursive:
-            # 再帰的に検索
-            for md_file in path.rglob("*.md"):
-                # 除外ディレクトリをチェック
-                if any(excluded_dir in md_file.parts for excluded_dir in excluded):
-                    continue
-
-                md_files.append(self.get_file_info(md_file))
-        else:
-            # 直下のみ
-            for md_file in path.glob("*.md"):
-                md_files.append(self.get_file_info(md_file))
+        # 除外ディレクトリには降りずに走査し、ファイル情報の取得（stat＋プレビュー読み込み）は並列化
+        created = time.monotonic()
+        dir_mtimes = {}
+        md_entries = list(self._walk(path, excluded, recursive, dir_mtimes))
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            md_files = list(executor.map(
+                lambda entry: self.get_file_info(Path(entry.path), entry.stat()), md_entries))
 
         # 重要度でソート
         md_files.sort(key=lambda x: (x['priority'], x['modified']), reverse=True)
 
-        return md_files
+        # キャッシュは設定済みプロジェクトのみ（任意のパス指定でキャッシュが増え続けないように）
+        if str(path) in self._project_paths:
+            self._listing_cache[cache_key] = (created, dir_mtimes, md_files)
+        return list(md_files)
+
+    def _is_listing_fresh(self, created: float, dir_mtimes: Dict[str, int]) -> bool:
+        """キャッシュしたファイル一覧が有効か判定"""
+        if time.monotonic() - created > LISTING_CACHE_TTL:
+            return False
+
+        try:
+            return all(os.stat(d).st_mtime_ns == mtime_ns for d, mtime_ns in dir_mtimes.items())
+        except OSError:
+            return False
+
+    def clear_listing_cache(self):
+        """ファイル一覧キャッシュを破棄"""
+        self._listing_cache.clear()
 
-    def get_file_info(self, file_path: Path) -> Dict:
-        """ファイル情報を取得"""
-        stat = file_path.stat()
+    def _walk(self, path: Path, excluded: set, recursive: bool = True,
+              dir_mtimes: Optional[Dict[str, int]] = None):
+        """MDファイルを列挙（除外ディレクトリは走査前にスキップ）"""
+        try:
+            # 走査前の更新日時を記録（一覧キャッシュの検証用）
+            if dir_mtimes is not None:
+                dir_mtimes[str(path)] = os.stat(path).st_mtime_ns
+            with os.scandir(path) as it:
+                entries = list(it)
+        except OSError:
+            return
+
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if recursive and entry.name not in excluded:
+                    yield from self._walk(Path(entry.path), excluded, recursive, dir_mtimes)
+            elif entry.name.endswith('.md') and entry.is_file():
+                yield entry
+
+    def get_file_info(self, file_path: Path, stat: Optional[os.stat_result] = None) -> Dict:
+        """ファイル情報を取得（取得済みのstat結果があれば再利用）"""
+        if stat is None:
+            stat = file_path.stat()
 
         # ファイルの重要度を判定
         priority = self.get_file_priority(file_path.name)
 
         # ファイルの最初の数行を取得（プレビュー用）
-        preview = self.get_file_preview(file_path)
+        preview = self.get_file_preview(file_path, mtime_ns=stat.st_mtime_ns)
 
         return {
             "name": file_path.name,
             "path": str(file_path),
-            "relative_path": str(file_path.relative_to(file_path.parent.parent)
-                                 if file_path.parent.parent.exists() else file_path.name),
+            # ファイルが存在すれば親の親ディレクトリも必ず存在する
+            "relative_path": str(file_path.relative_to(file_path.parent.parent)),
             "size": stat.st_size,
             "size_kb": round(stat.st_size / 1024, 2),
             "modified": datetime.fromtimestamp(stat.st_mtime).isoformat(),
@@ -140,34 +455,37 @@ class MDFileBrowser:
 
     def get_file_priority(self, filename: str) -> int:
         """ファイルの重要度を判定"""
-        important_patterns = self.config.get("file_patterns", {}).get("important", [])
-
-        for pattern in important_patterns:
-            if pattern.replace("*", "") in filename.upper():
-                return 1  # 最高優先度
+        for pattern, rank in self._priority_patterns:
+            if pattern.match(filename):
+                return rank
 
-        if filename.upper() == "README.MD":
+        name = filename.upper()
+        if name == "README.MD":
             return 2
-        elif "REPORT" in filename.upper():
+        elif "REPORT" in name:
             return 3
-        elif "PLAN" in filename.upper():
+        elif "PLAN" in name:
             return 4
-        elif "SUMMARY" in filename.upper():
+        elif "SUMMARY" in name:
             return 5
 
         return 10  # 通常優先度
 
-    def get_file_preview(self, file_path: Path, lines: int = 3) -> str:
-        """ファイルのプレビューを取得"""
+    def get_file_preview(self, file_path: Path, lines: int = 3, mtime_ns: Optional[int] = None) -> str:
+        """ファイルのプレビューを取得（更新日時が変わるまでキャッシュ）"""
+        if mtime_ns is None:
+            mtime_ns = file_path.stat().st_mtime_ns
+        return self._preview_cached(str(file_path), mtime_ns, lines)
+
+    @lru_cache(maxsize=1024)
+    def _preview_cached(self, file_path: str, mtime_ns: int, lines: int) -> str:
+        """プレビューを生成（キーは (パス, 更新日時)）"""
         try:
-            # まずUTF-8で試す
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content_lines = f.readlines()[:lines + 5]  # ヘッダーをスキップするため多めに取得
-            except UnicodeDecodeError:
-                # UTF-8で失敗したら強制的に読み込み
-                with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
-                    content_lines = f.readlines()[:lines + 5]
+            # 先頭部分だけを読み込む（ファイルサイズに関係なく一定コスト）
+            with open(file_path, 'rb') as f:
+                raw = f.read(PREVIEW_READ_BYTES)
+            encoding = self.detect_bom(raw) or 'utf-8'
+            content_lines = raw.decode(encoding, errors='replace').split('\n')[:lines + 5]  # ヘッダーをスキップするため多めに取得
 
             # マークダウンのヘッダーをスキップ
             preview_lines = []
@@ -186,143 +504,214 @@ class MDFileBrowser:
         except Exception as e:
             return f"プレビュー取得エラー: {str(e)}"
 
+    def detect_bom(self, raw: bytes) -> Optional[str]:
+        """BOMからエンコーディングを判定"""
+        for bom, encoding in BOM_ENCODINGS:
+            if raw.startswith(bom):
+                return encoding
+        return None
+
     def read_md_file(self, file_path: str) -> Dict:
         """MDファイルを読み込んでHTMLに変換"""
         try:
             path = Path(file_path)
 
-            if not path.exists():
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
                 return {"error": "ファイルが見つかりません"}
 
-            # まずUTF-8で読み込みを試みる
-            content = None
-            encoding_used = 'utf-8'
+            # 更新日時とサイズが変わっていなければキャッシュ済みの結果を使う
+            rendered = self._get_rendered(str(path), stat)
 
-            try:
-                with open(path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                    encoding_used = 'utf-8'
-            except UnicodeDecodeError:
-                # UTF-8で失敗したらエンコーディングを自動検出
-                with open(path, 'rb') as f:
-                    raw_data = f.read()
-                    result = chardet.detect(raw_data)
-                    detected_encoding = result['encoding']
-
-                    # 検出されたエンコーディングで読み込み
-                    if detected_encoding:
-                        try:
-                            content = raw_data.decode(detected_encoding)
-                            encoding_used = detected_encoding
-                        except:
-                            # それでも失敗したらUTF-8で強制的に読み込み（エラー文字は置換）
-                            content = raw_data.decode('utf-8', errors='replace')
-                            encoding_used = 'utf-8 (forced)'
-                    else:
-                        # エンコーディング検出失敗時はUTF-8で強制読み込み
-                        content = raw_data.decode('utf-8', errors='replace')
-                        encoding_used = 'utf-8 (forced)'
-
-            # 目次を生成（先に生成してIDを取得）
-            toc = self.generate_toc(content)
-
-            # マークダウンをHTMLに変換
-            html_content = self.markdown_renderer.convert(content)
-
-            # 見出しにIDを追加（日本語対応）
-            for item in toc:
-                # 見出しタグを検索して、IDを追加
-                pattern = f"<h{item['level']}>({re.escape(item['title'])})</h{item['level']}>"
-                replacement = f"<h{item['level']} id=\"{item['anchor']}\">{item['title']}</h{item['level']}>"
-                html_content = re.sub(pattern, replacement, html_content)
-
-            # ファイル情報
-            file_info = self.get_file_info(path)
+            # ファイル情報（stat結果を使い回す）
+            file_info = self.get_file_info(path, stat)
 
             return {
-                "content": content,
-                "html": html_content,
-                "toc": toc,
+                "content": rendered["content"],
+                "html": rendered["html"],
+                "toc": rendered["toc"],
                 "info": file_info,
-                "encoding": encoding_used
+                "encoding": rendered["encoding"]
             }
 
         except Exception as e:
             return {"error": f"ファイル読み込みエラー: {str(e)}"}
 
-    def generate_toc(self, content: str) -> List[Dict]:
-        """目次を生成"""
-        toc = []
-        lines = content.split('\n')
-
-        for line in lines:
-            # マークダウンの見出しを検出
-            match = re.match(r'^(#{1,6})\s+(.+)$', line)
-            if match:
-                level = len(match.group(1))
-                title = match.group(2)
-                # markdown2のheader-idsと同じ方法でIDを生成
-                # 日本語を含む場合も考慮
-                import unicodedata
-                # NFKDで分解して、ASCIIに変換可能な文字のみを残す
-                anchor = unicodedata.normalize('NFKD', title.lower())
-                anchor = re.sub(r'[^\w\s-]', '', anchor)
-                anchor = re.sub(r'[-\s]+', '-', anchor).strip('-')
-                # 空になった場合は、簡単なハッシュを使用
-                if not anchor:
-                    import hashlib
-                    anchor = 'heading-' + hashlib.md5(title.encode()).hexdigest()[:8]
+    def _get_rendered(self, file_path: str, stat: os.stat_result) -> Dict:
+        """レンダリング結果を取得（上限サイズ以下のファイルのみキャッシュ）"""
+        with self._render_cache_lock:
+            cached = self._render_cache.get(file_path)
+            if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+                self._render_cache.move_to_end(file_path)
+                return cached[2]
+
+        rendered = self._render(file_path)
+
+        # 大きなファイルはメモリを圧迫するためキャッシュしない
+        if stat.st_size <= self.config.get("max_file_size_kb", 5000) * 1024:
+            with self._render_cache_lock:
+                # 同じパスの古い結果は置き換える
+                self._render_cache[file_path] = (stat.st_mtime_ns, stat.st_size, rendered)
+                self._render_cache.move_to_end(file_path)
+                while len(self._render_cache) > RENDER_CACHE_SIZE:
+                    self._render_cache.popitem(last=False)
+
+        return rendered
+
+    def _render(self, file_path: str) -> Dict:
+        """MDファイルを読み込んでHTMLに変換"""
+        path = Path(file_path)
+
+        # まずUTF-8で読み込みを試みる
+        content = None
+        encoding_used = 'utf-8'
+
+        with open(path, 'rb') as f:
+            raw_data = f.read()
+
+        # BOMがあればそのエンコーディングで確定（自動検出は不要）
+        bom_encoding = self.detect_bom(raw_data)
+
+        try:
+            if bom_encoding:
+                content = raw_data.decode(bom_encoding)
+                encoding_used = bom_encoding
+            else:
+                # ASCIIのみのファイルもUTF-8として一度でデコードできる
+                content, _ = UTF8_DECODE(raw_data)
+                encoding_used = 'utf-8'
+        except UnicodeDecodeError:
+            # UTF-8で失敗したらエンコーディングを自動検出（先頭部分のみで判定）
+            result = chardet.detect(raw_data[:CHARDET_SAMPLE_BYTES])
+            detected_encoding = result['encoding']
+
+            # 検出されたエンコーディングで読み込み
+            if detected_encoding:
+                try:
+                    content = raw_data.decode(detected_encoding)
+                    encoding_used = detected_encoding
+                except:
+                    # それでも失敗したらUTF-8で強制的に読み込み（エラー文字は置換）
+                    content = raw_data.decode('utf-8', errors='replace')
+                    encoding_used = 'utf-8 (forced)'
+            else:
+                # エンコーディング検出失敗時はUTF-8で強制読み込み
+                content = raw_data.decode('utf-8', errors='replace')
+                encoding_used = 'utf-8 (forced)'
+
+        # テキストモードで読んだ場合と同様に改行コードを統一
+        content = content.replace('\r\n', '\n').replace('\r', '\n')
+
+        # マークダウンをHTMLに変換（目次は変換中に作成される）
+        html_content, state = self.markdown_renderer.parse(content)
+        toc = state.env["toc"]
+
+        return {
+            "content": content,
+            "html": html_content,
+            "toc": toc,
+            "encoding": encoding_used
+        }
 
+    def make_anchor(self, title: str) -> str:
+        """見出しのアンカーIDを生成"""
+        # 日本語を含む場合も考慮
+        # NFKDで分解して、ASCIIに変換可能な文字のみを残す
+        anchor = unicodedata.normalize('NFKD', title.lower())
+        anchor = ANCHOR_NONWORD_RE.sub('', anchor)
+        anchor = ANCHOR_DASH_RE.sub('-', anchor).strip('-')
+        # 空になった場合は、簡単なハッシュを使用
+        if not anchor:
+            anchor = 'heading-' + hashlib.md5(title.encode()).hexdigest()[:8]
+        return anchor
+
+    def _collect_headings(self, md: mistune.Markdown, state: mistune.BlockState):
+        """見出しにアンカーIDを設定し、目次を作成（mistuneのレンダリング前フック）"""
+        toc = []
+        for token in state.tokens:
+            if token["type"] == "heading":
+                title = token["text"].strip()
+                anchor = self.make_anchor(title)
+                token["attrs"]["id"] = anchor
                 toc.append({
-                    "level": level,
+                    "level": token["attrs"]["level"],
                     "title": title,
                     "anchor": anchor
                 })
-
-        return toc
+        state.env["toc"] = toc
 
     def search_in_files(self, query: str, project_path: Optional[str] = None) -> List[Dict]:
         """ファイル内を検索"""
         results = []
         query_lower = query.lower()
 
+        # バイト列のまま部分一致で絞り込むための検索語
+        # ASCIIの検索語は小文字化したバイト列、大文字小文字のない検索語（日本語など）はそのまま比較できる
+        if query_lower.isascii():
+            query_bytes, lower_raw = query_lower.encode('utf-8'), True
+        elif query_lower == query.upper():
+            query_bytes, lower_raw = query_lower.encode('utf-8'), False
+        else:
+            query_bytes, lower_raw = None, False
+
+        max_size = self.config.get("max_file_size_kb", 5000) * 1024
+
         if project_path:
             projects = [{"path": project_path}]
         else:
             projects = self.config.get("projects", [])
 
+        # 除外ディレクトリのセット
+        excluded = set(self.config.get("excluded_dirs", []))
+
         for project in projects:
             path = Path(project["path"])
             if not path.exists():
                 continue
 
-            for md_file in path.rglob("*.md"):
-                # 除外ディレクトリをチェック
-                excluded = set(self.config.get("excluded_dirs", []))
-                if any(excluded_dir in md_file.parts for excluded_dir in excluded):
-                    continue
-
+            # 除外ディレクトリには降りずに走査
+            for entry in self._walk(path, excluded):
+                md_file = Path(entry.path)
                 try:
-                    with open(md_file, 'r', encoding='utf-8', errors='ignore') as f:
-                        content = f.read()
-
-                    if query_lower in content.lower():
-                        # マッチした行を取得
-                        lines = content.split('\n')
-                        matches = []
-
-                        for i, line in enumerate(lines):
-                            if query_lower in line.lower():
-                                matches.append({
-                                    "line_number": i + 1,
-                                    "line": line.strip()[:100],  # 最初の100文字
-                                })
-
-                        if matches:
-                            file_info = self.get_file_info(md_file)
-                            file_info["matches"] = matches[:5]  # 最初の5つのマッチ
-                            file_info["total_matches"] = len(matches)
-                            results.append(file_info)
+                    # 上限サイズを超えるファイルは開かずにスキップ
+                    stat = entry.stat()
+                    if stat.st_size > max_size:
+                        continue
+
+                    with open(md_file, 'rb') as f:
+                        raw = f.read()
+
+                    # マッチしないファイルはデコードせずにスキップ
+                    if query_bytes is not None and query_bytes not in (raw.lower() if lower_raw else raw):
+                        continue
+
+                    content, _ = UTF8_DECODE(raw, 'ignore')
+                    content_lower = content.lower()
+
+                    # マッチした行番号を先頭から最大5行分だけ取得
+                    match_lines = []
+                    line_number = 1
+                    scanned = 0
+                    pos = content_lower.find(query_lower)
+                    while pos != -1 and len(match_lines) < 5:
+                        line_number += content_lower.count('\n', scanned, pos)
+                        match_lines.append(line_number)
+                        # 同じ行の残りは飛ばして次の行から探す
+                        scanned = content_lower.find('\n', pos)
+                        if scanned == -1:
+                            break
+                        pos = content_lower.find(query_lower, scanned + 1)
+
+                    if match_lines:
+                        lines = content.split('\n', match_lines[-1])
+                        file_info = self.get_file_info(md_file, stat)
+                        file_info["matches"] = [{
+                            "line_number": n,
+                            "line": lines[n - 1].strip()[:100],  # 最初の100文字
+                        } for n in match_lines]
+                        file_info["total_matches"] = content_lower.count(query_lower)
+                        results.append(file_info)
 
                 except Exception:
                     continue
@@ -336,8 +725,8 @@ class MDFileBrowser:
         for project in self.config.get("projects", []):
             files = self.get_project_md_files(project["path"], recursive=True)
             for file in files:
-                file["project"] = project["name"]
-                all_files.append(file)
+                # キャッシュ済みの一覧を書き換えないようコピーに付与
+                all_files.append(dict(file, project=project["name"]))
 
         # 更新日時でソート
         all_files.sort(key=lambda x: x['modified'], reverse=True)
@@ -346,208 +735,101 @@ class MDFileBrowser:
         count = self.config.get("recent_files_count", 10)
         return all_files[:count]
 
-    def generate_pdf(self, file_path: str) -> BytesIO:
-        """MDファイルからPDFを生成"""
+    def generate_pdf(self, file_path: str, output: Optional[BinaryIO] = None) -> Optional[BinaryIO]:
+        """MDファイルからPDFを生成（出力先を省略した場合はBytesIOに書き込む）"""
         # ファイルを読み込む
         file_data = self.read_md_file(file_path)
 
         if file_data.get("error"):
             return None
 
-        # HTML生成
-        html_template = """
-        <!DOCTYPE html>
-        <html lang="ja">
-        <head>
-            <meta charset="UTF-8">
-            <style>
-                @page {
-                    size: A4;
-                    margin: 20mm;
-                    @bottom-center {
-                        content: counter(page) " / " counter(pages);
-                        font-size: 10pt;
-                        color: #666;
-                    }
-                }
-
-                body {
-                    font-family: 'Noto Sans CJK JP', 'Hiragino Sans', 'Yu Gothic', sans-serif;
-                    line-height: 1.8;
-                    color: #333;
-                }
-
-                h1 {
-                    color: #2c3e50;
-                    border-bottom: 2px solid #3498db;
-                    padding-bottom: 10px;
-                    margin: 30px 0 20px;
-                    page-break-after: avoid;
-                }
-
-                h2 {
-                    color: #34495e;
-                    border-bottom: 1px solid #bdc3c7;
-                    padding-bottom: 8px;
-                    margin: 25px 0 15px;
-                    page-break-after: avoid;
-                }
-
-                h3 {
-                    color: #34495e;
-                    margin: 20px 0 10px;
-                    page-break-after: avoid;
-                }
-
-                p {
-                    margin: 12px 0;
-                    text-align: justify;
-                }
-
-                code {
-                    background: #f5f5f5;
-                    padding: 2px 6px;
-                    border-radius: 3px;
-                    font-family: 'Consolas', 'Monaco', monospace;
-                    font-size: 0.9em;
-                }
-
-                pre {
-                    background: #f8f8f8;
-                    border: 1px solid #ddd;
-                    padding: 15px;
-                    border-radius: 5px;
-                    overflow-x: auto;
-                    page-break-inside: avoid;
-                    margin: 15px 0;
-                }
-
-                pre code {
-                    background: none;
-                    padding: 0;
-                }
-
-                table {
-                    border-collapse: collapse;
-                    width: 100%;
-                    margin: 20px 0;
-                    page-break-inside: avoid;
-                }
-
-                th, td {
-                    border: 1px solid #ddd;
-                    padding: 10px 15px;
-                    text-align: left;
-                }
-
-                th {
-                    background: #f8f9fa;
-                    font-weight: bold;
-                }
-
-                tr:nth-child(even) {
-                    background: #f9f9f9;
-                }
-
-                ul, ol {
-                    margin: 15px 0;
-                    padding-left: 30px;
-                }
-
-                li {
-                    margin: 5px 0;
-                }
-
-                blockquote {
-                    border-left: 4px solid #3498db;
-                    padding-left: 20px;
-                    margin: 20px 0;
-                    color: #666;
-                    font-style: italic;
-                }
-
-                a {
-                    color: #3498db;
-                    text-decoration: none;
-                }
-
-                .header {
-                    text-align: center;
-                    margin-bottom: 40px;
-                    padding-bottom: 20px;
-                    border-bottom: 2px solid #3498db;
-                }
-
-                .header h1 {
-                    border: none;
-                    margin: 0;
-                    padding: 0;
-                    font-size: 2em;
-                }
-
-                .metadata {
-                    margin-top: 10px;
-                    font-size: 0.9em;
-                    color: #666;
-                }
-
-                .footer {
-                    margin-top: 50px;
-                    padding-top: 20px;
-                    border-top: 1px solid #ddd;
-                    text-align: center;
-                    font-size: 0.85em;
-                    color: #666;
-                }
-            </style>
-        </head>
-        <body>
-            <div class="header">
-                <h1>{title}</h1>
-                <div class="metadata">
-                    生成日: {date}<br>
-                    エンコーディング: {encoding}
-                </div>
-            </div>
-
-            {content}
-
-            <div class="footer">
-                MD Document Browser でエクスポート
-            </div>
-        </body>
-        </html>
-        """
-
         # HTMLを生成
-        html_content = html_template.format(
-            title=file_data['info']['name'],
-            date=datetime.now().strftime('%Y年%m月%d日 %H:%M'),
-            encoding=file_data.get('encoding', 'UTF-8'),
-            content=file_data['html']
-        )
+        html_content = PDF_TEMPLATE.format_map({
+            "title": file_data['info']['name'],
+            "date": datetime.now().strftime('%Y年%m月%d日 %H:%M'),
+            "encoding": file_data.get('encoding', 'UTF-8'),
+            "content": file_data['html']
+        })
 
         # PDFを生成
-        pdf_buffer = BytesIO()
+        pdf_buffer = output if output is not None else BytesIO()
 
         # WeasyprintでPDF生成
         doc = weasyprint.HTML(string=html_content)
-        doc.write_pdf(pdf_buffer)
+        font_config, css = get_pdf_resources()
+        doc.write_pdf(pdf_buffer, stylesheets=[css], font_config=font_config)
 
-        pdf_buffer.seek(0)
+        if output is None:
+            pdf_buffer.seek(0)
         return pdf_buffer
 
+    def get_cached_pdf(self, file_path: str) -> Optional[str]:
+        """生成済みPDFのパスを取得（未生成・元ファイル更新時は生成してキャッシュ）"""
+        path = Path(file_path)
+        try:
+            mtime_ns = path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+        # キャッシュ名は (絶対パスのハッシュ, 更新日時, スタイルのバージョン)
+        path_hash = hashlib.sha1(str(path.resolve()).encode('utf-8')).hexdigest()
+        cache_dir = Path(PDF_CACHE_DIR)
+        cache_path = cache_dir / f"{path_hash}-{mtime_ns}-{STYLE_VERSION}.pdf"
+
+        if cache_path.exists():
+            return str(cache_path)
+
+        # 一時ファイルに直接書き出してから置き換え（書き込み途中のPDFを返さないため）
+        cache_dir.mkdir(exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                generated = self.generate_pdf(file_path, f)
+            if not generated:
+                os.unlink(tmp_path)
+                return None
+            os.replace(tmp_path, cache_path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+        # 同じファイルの古いキャッシュを削除
+        for old_pdf in cache_dir.glob(f"{path_hash}-*.pdf"):
+            if old_pdf != cache_path:
+                old_pdf.unlink(missing_ok=True)
+
+        return str(cache_path)
+
+
+def render_warm_up_pdf(barrier: threading.Barrier):
+    """ダミーのPDFを生成（フォント解決とCSS処理を済ませておく）"""
+    font_config, css = get_pdf_resources()
+    weasyprint.HTML(string="<p>warm up</p>").write_pdf(
+        BytesIO(), stylesheets=[css], font_config=font_config)
+    # 全スレッドが揃うまで待ち、1つのスレッドが複数回実行しないようにする
+    barrier.wait(timeout=60)
+
+
+def warm_up_pdf():
+    """PDF生成スレッドを事前に起動してウォームアップ（初回PDF生成の待ち時間を短縮）"""
+    barrier = threading.Barrier(PDF_WORKERS)
+    futures = [PDF_EXECUTOR.submit(render_warm_up_pdf, barrier) for _ in range(PDF_WORKERS)]
+    for future in futures:
+        future.result()
+
 
 # グローバルインスタンス
 browser = MDFileBrowser()
 
+# PDF生成用スレッドプール（重い処理の同時実行数を制限し、他のリクエストを待たせない）
+PDF_EXECUTOR = ThreadPoolExecutor(max_workers=PDF_WORKERS, initializer=init_pdf_thread)
+
 
 @app.route('/')
 def index():
     """メインページ"""
-    response = Response(render_template('index.html'))
-    response.headers['Content-Type'] = 'text/html; charset=utf-8'
-    return response
+    # テンプレート変数を使っていないため、ファイルをそのまま返す（sendfileによるゼロコピー転送）
+    return send_from_directory(app.template_folder, 'index.html')
 
 
 @app.route('/api/projects')
@@ -603,7 +885,7 @@ def config():
     else:
         new_config = request.json
         browser.save_config(new_config)
-        browser.config = new_config
+        browser.apply_config(new_config)
         return jsonify({"status": "success"})
 
 
@@ -616,19 +898,21 @@ def generate_pdf():
         return jsonify({"error": "ファイルパスが指定されていません"}), 400
 
     try:
-        pdf_buffer = browser.generate_pdf(file_path)
+        pdf_path = PDF_EXECUTOR.submit(browser.get_cached_pdf, file_path).result()
 
-        if not pdf_buffer:
+        if not pdf_path:
             return jsonify({"error": "PDF生成に失敗しました"}), 500
 
         # ファイル名を生成
         filename = Path(file_path).stem + '.pdf'
 
+        # キャッシュファイルをそのまま返す（sendfileによるゼロコピー転送）
         return send_file(
-            pdf_buffer,
+            os.path.abspath(pdf_path),
             mimetype='application/pdf',
             as_attachment=True,
-            download_name=filename
+            download_name=filename,
+            conditional=True
         )
     except Exception as e:
         return jsonify({"error": f"PDF生成エラー: {str(e)}"}), 500
@@ -646,4 +930,9 @@ if __name__ == '__main__':
     print("Ctrl+C で終了")
     print("="*60)
 
-    app.run(host='0.0.0.0', port=5555, debug=True)
\ No newline at end of file
+    # PDF生成の初回コストを起動時に払っておく
+    warm_up_pdf()
+
+    # デバッグモードは環境変数で有効化（本番ではgunicorn等のWSGIサーバーを推奨）
+    debug = os.environ.get('MD_BROWSER_DEBUG', '').lower() in ('1', 'true')
+    app.run(host='0.0.0.0', port=5555, debug=debug, threaded=True)
\ No newline at end of file